@@ -1,34 +1,51 @@
 import os
+from dataclasses import dataclass
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Обязательные параметры: (переменная окружения, поле конфигурации)
+_REQUIRED = (
+    ('TELEGRAM_BOT_TOKEN', 'telegram_bot_token'),
+    ('GOOGLE_API_KEY', 'google_api_key'),
+    ('TARGET_GROUP_ID', 'target_group_id'),
+)
+
+@dataclass(frozen=True, slots=True)
 class Config:
     """Конфигурация бота"""
     
     # Telegram
-    TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    TARGET_GROUP_ID = os.getenv('TARGET_GROUP_ID', '-123')
+    telegram_bot_token: Optional[str]
+    target_group_id: Optional[str]
     
     # Google Gemini API
-    GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+    google_api_key: Optional[str]
     
     # Модели Gemini
-    TEXT_MODEL = 'gemini-2.5-pro-preview-03-25'
-    IMAGE_MODEL = 'gemini-2.5-flash-image-preview'
+    text_model: str = 'gemini-2.5-pro-preview-03-25'
+    image_model: str = 'gemini-2.5-flash-image-preview'
     
     @classmethod
-    def validate(cls):
+    def from_env(cls) -> 'Config':
+        """Прочитать конфигурацию из переменных окружения (один раз)"""
+        return cls(
+            telegram_bot_token=os.getenv('TELEGRAM_BOT_TOKEN'),
+            target_group_id=os.getenv('TARGET_GROUP_ID', '-123'),
+            google_api_key=os.getenv('GOOGLE_API_KEY')
+        )
+    
+    def validate(self) -> None:
         """Проверка наличия обязательных параметров"""
-        required = {
-            'TELEGRAM_BOT_TOKEN': cls.TELEGRAM_BOT_TOKEN,
-            'GOOGLE_API_KEY': cls.GOOGLE_API_KEY,
-            'TARGET_GROUP_ID': cls.TARGET_GROUP_ID
-        }
-        
-        missing = [key for key, value in required.items() if not value]
+        # Быстрый путь без аллокаций, когда все параметры заданы
+        if all(getattr(self, field) for _, field in _REQUIRED):
+            return
         
-        if missing:
-            raise ValueError(
-                f"Отсутствуют обязательные переменные окружения: {', '.join(missing)}"
-            )
\ No newline at end of file
+        missing = [key for key, field in _REQUIRED if not getattr(self, field)]
+        raise ValueError(
+            f"Отсутствуют обязательные переменные окружения: {', '.join(missing)}"
+        )
+
+
+CONFIG = Config.from_env()
\ No newline at end of file
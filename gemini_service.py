@@ -1,22 +1,151 @@
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from io import BytesIO
-from PIL import Image
 import logging
 import asyncio
+import binascii
 import time
-from config import Config
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from pathlib import Path
+from tenacity import (
+    before_sleep_log,
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+from config import CONFIG
 
 logger = logging.getLogger(__name__)
 
+# Постоянные части промптов
+_SHORTEN_PREFIX = "Укороти новость: "
+_SHORTEN_SUFFIX = ". Ответ должен содержать ТОЛЬКО новость!"
+_IMAGE_PROMPT_PREFIX = "Напиши промт для фото к новости, скинь только промт: "
+_EDIT_PREFIX = "Изменить текст согласно инструкции: '"
+_EDIT_MIDDLE = "'. Текущий текст: '"
+_EDIT_SUFFIX = "'. Верни только измененный текст, без лишних объяснений."
+
+
+class TransientGeminiError(Exception):
+    """Временная ошибка Gemini API (429, 5xx, таймаут), запрос можно повторить"""
+
+
+# Ошибки API, при которых имеет смысл повторить запрос
+_TRANSIENT_API_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServerError,
+    TimeoutError,
+)
+
+# Повтор запроса: до 3 попыток с экспоненциальной задержкой и джиттером.
+# Ошибки авторизации и прочие ошибки клиента пробрасываются сразу
+_retry_transient = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(initial=1, max=8),
+    retry=retry_if_exception_type(TransientGeminiError),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+
+
+def _memoize_async(maxsize: int = 256, ttl: float = 1800):
+    """
+    Кэширование результатов асинхронного метода с ограничением по размеру и времени жизни
+    
+    Одновременные вызовы с одинаковыми аргументами объединяются в один запрос
+    к API: пока запрос выполняется, остальные вызовы ждут ту же задачу.
+    В кэш попадают только успешные результаты.
+    
+    Args:
+        maxsize: Максимальное количество записей
+        ttl: Время жизни записи в секундах
+    """
+    def decorator(func):
+        cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        inflight: dict[str, asyncio.Future] = {}
+        
+        @wraps(func)
+        async def wrapper(self, *args: str):
+            # Ключ - хэш аргументов, чтобы не хранить полный текст новости дважды
+            digest = hashlib.blake2b(digest_size=16)
+            for arg in args:
+                digest.update(arg.encode('utf-8'))
+                digest.update(b'\0')
+            key = digest.hexdigest()
+            
+            entry = cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                cache.move_to_end(key)
+                logger.debug("Результат %s взят из кэша", func.__name__)
+                return entry[1]
+            
+            future = inflight.get(key)
+            if future is not None:
+                logger.debug("Ожидаем уже выполняющийся запрос %s", func.__name__)
+                return await asyncio.shield(future)
+            
+            def _complete(done: asyncio.Future) -> None:
+                inflight.pop(key, None)
+                if done.cancelled() or done.exception() is not None:
+                    return
+                cache[key] = (time.monotonic(), done.result())
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            
+            future = asyncio.ensure_future(func(self, *args))
+            inflight[key] = future
+            future.add_done_callback(_complete)
+            return await asyncio.shield(future)
+        
+        return wrapper
+    return decorator
+
+
+def _extract_inline_data(response) -> bytes | None:
+    """
+    Извлечь данные изображения из ответа модели
+    
+    Args:
+        response: Ответ модели изображений
+        
+    Returns:
+        Байты изображения или None, если изображения в ответе нет
+    """
+    try:
+        parts = response.candidates[0].content.parts
+    except (AttributeError, IndexError):
+        parts = getattr(response, 'parts', ())
+    
+    for part in parts:
+        inline_data = getattr(part, 'inline_data', None)
+        if inline_data:
+            data = inline_data.data
+            # Декодируем base64 если нужно. a2b_base64 принимает ASCII-строку
+            # напрямую, без промежуточной копии, которую делает b64decode
+            if isinstance(data, str):
+                data = binascii.a2b_base64(data)
+            return data
+    
+    return None
+
+
+# Заглушка статична, поэтому поставляется готовым PNG и читается один раз при импорте
+_PLACEHOLDER_PNG: bytes = (Path(__file__).parent / "placeholder.png").read_bytes()
+
 
 class GeminiService:
     """Сервис для работы с Google Gemini API"""
     
     def __init__(self):
-        genai.configure(api_key=Config.GOOGLE_API_KEY)
-        self.text_model = genai.GenerativeModel(Config.TEXT_MODEL)
-        self.image_model = genai.GenerativeModel(Config.IMAGE_MODEL)
+        genai.configure(api_key=CONFIG.google_api_key)
+        self.text_model = genai.GenerativeModel(CONFIG.text_model)
+        self.image_model = genai.GenerativeModel(CONFIG.image_model)
     
+    @_memoize_async()
     async def shorten_news(self, news_text: str) -> str:
         """
         Сократить новость для поста в соцсетях
@@ -27,59 +156,76 @@ class GeminiService:
         Returns:
             Сокращенная версия новости
         """
-        prompt = f"Укороти новость: {news_text}. Ответ должен содержать ТОЛЬКО новость!"
+        prompt = _SHORTEN_PREFIX + news_text + _SHORTEN_SUFFIX
         
-        for attempt in range(3):
-            try:
-                response = await self.text_model.generate_content_async(prompt)
-                
-                if not response or not response.text:
-                    raise ValueError("Пустой ответ от модели")
-                
-                shortened_text = response.text.strip()
-                logger.info(f"Новость сокращена: {len(news_text)} -> {len(shortened_text)} символов")
-                
-                return shortened_text
-                
-            except Exception as e:
-                logger.warning(f"Попытка {attempt + 1} не удалась при сокращении новости: {e}")
-                if attempt == 2:
-                    logger.error(f"Ошибка при сокращении новости после 3 попыток: {e}")
-                    raise
-                await asyncio.sleep(2 ** attempt)  # exponential backoff
+        try:
+            shortened_text = await self._generate_text(prompt)
+        except Exception as e:
+            logger.error("Ошибка при сокращении новости: %s", e)
+            raise
+        
+        logger.info("Новость сокращена: %d -> %d символов", len(news_text), len(shortened_text))
+        
+        return shortened_text
     
     async def generate_image_prompt(self, news_text: str) -> str:
         """
         Сгенерировать промпт для создания изображения
         
+        Не кэшируется: перегенерация изображения должна получать новый промпт.
+        
         Args:
             news_text: Текст новости
             
         Returns:
             Промпт для генерации изображения
         """
-        prompt = f"Напиши промт для фото к новости, скинь только промт: {news_text}"
+        prompt = _IMAGE_PROMPT_PREFIX + news_text
         
-        for attempt in range(3):
-            try:
-                response = await self.text_model.generate_content_async(prompt)
-                
-                if not response or not response.text:
-                    raise ValueError("Пустой ответ от модели")
-                
-                image_prompt = response.text.strip()
-                logger.info(f"Сгенерирован промпт для изображения: {image_prompt[:100]}...")
-                
-                return image_prompt
-                
-            except Exception as e:
-                logger.warning(f"Попытка {attempt + 1} не удалась при генерации промпта: {e}")
-                if attempt == 2:
-                    logger.error(f"Ошибка при генерации промпта после 3 попыток: {e}")
-                    raise
-                await asyncio.sleep(2 ** attempt)  # exponential backoff
+        try:
+            image_prompt = await self._generate_text(prompt)
+        except Exception as e:
+            logger.error("Ошибка при генерации промпта: %s", e)
+            raise
+        
+        logger.info("Сгенерирован промпт для изображения: %.100s...", image_prompt)
+        
+        return image_prompt
+    
+    @_memoize_async()
+    async def _first_image_prompt(self, news_text: str) -> str:
+        """
+        Промпт для первого изображения к новости (кэшируется)
+        
+        Args:
+            news_text: Текст новости
+            
+        Returns:
+            Промпт для генерации изображения
+        """
+        return await self.generate_image_prompt(news_text)
     
 
+    async def generate_image(self, news_text: str, user_image=None) -> BytesIO:
+        """
+        Получить изображение для новости: пользовательское или сгенерированное
+        
+        Args:
+            news_text: Текст новости
+            user_image: Пользовательское изображение (опционально)
+            
+        Returns:
+            BytesIO с изображением
+        """
+        if user_image is not None:
+            # Используем предоставленное изображение
+            logger.info("Используем пользовательское изображение")
+            return user_image
+        
+        # Генерируем промпт и изображение
+        image_prompt = await self._first_image_prompt(news_text)
+        return await self._generate_image_async(image_prompt)
+    
     async def process_news_full(self, news_text: str, message=None, user_image=None) -> tuple[str, BytesIO]:
         """
         Полный цикл обработки новости: сокращение + генерация изображения
@@ -96,37 +242,30 @@ class GeminiService:
             # Сокращаем текст
             shortened_text = await self.shorten_news(news_text)
             
-            # Обновляем сообщение после сокращения текста
-            if message:
-                await message.edit_text(
-                    "Генерирую изображение"
-                )
+            # Промпт строится по сокращенному тексту, как и при перегенерации изображения.
+            # Цепочка (промпт + генерация) запускается сразу и идет параллельно с обновлением статуса
+            image_task = asyncio.create_task(self.generate_image(shortened_text, user_image))
             
-            # Проверяем, предоставлено ли пользовательское изображение
-            if user_image is not None:
-                # Используем предоставленное изображение
-                image = user_image
-                logger.info("Используем пользовательское изображение")
-            else:
-                # Генерируем промпт для изображения
-                image_prompt = await self.generate_image_prompt(shortened_text)
-                
-                # Генерируем изображение (используем синхронный вызов в executor)
-                import asyncio
-                loop = asyncio.get_event_loop()
-                image = await loop.run_in_executor(
-                    None, 
-                    lambda: self._generate_image_sync(image_prompt)
-                )
+            try:
+                # Обновляем сообщение после сокращения текста
+                if message:
+                    await message.edit_text(
+                        "Генерирую изображение"
+                    )
+            except Exception:
+                image_task.cancel()
+                raise
+            
+            image = await image_task
             
             return shortened_text, image
         except Exception as e:
-            logger.error(f"Ошибка в process_news_full: {e}")
+            logger.error("Ошибка в process_news_full: %s", e)
             raise
     
-    def _generate_image_sync(self, prompt: str) -> BytesIO:
+    async def _generate_image_async(self, prompt: str) -> BytesIO:
         """
-        Синхронная генерация изображения (для использования в executor)
+        Асинхронная генерация изображения
         
         Args:
             prompt: Промпт для генерации
@@ -134,66 +273,80 @@ class GeminiService:
         Returns:
             BytesIO с изображением
         """
-        for attempt in range(3):
-            try:
-                logger.info(f"Генерация изображения по промпту: {prompt[:100]}...")
-                
-                response = self.image_model.generate_content(prompt)
-                
-                if not response:
-                    raise ValueError("Пустой ответ от модели")
-                
-                # Извлекаем изображение
-                image_data = None
-                
-                # Проверяем различные структуры ответа
-                if hasattr(response, 'candidates') and len(response.candidates) > 0:
-                    candidate = response.candidates[0]
-                    if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                        for part in candidate.content.parts:
-                            if hasattr(part, 'inline_data') and part.inline_data:
-                                image_data = part.inline_data.data
-                                break
-                
-                if not image_data and hasattr(response, 'parts'):
-                    for part in response.parts:
-                        if hasattr(part, 'inline_data') and part.inline_data:
-                            image_data = part.inline_data.data
-                            break
-                
-                # Если изображение не получено, создаем заглушку
-                if not image_data:
-                    logger.warning("Не удалось извлечь изображение из ответа API, создаем заглушку")
-                    return self._create_placeholder_image(prompt)
-                
-                # Декодируем base64 если нужно
-                if isinstance(image_data, str):
-                    import base64
-                    image_data = base64.b64decode(image_data)
-                
-                image_bytes = BytesIO(image_data)
-                image_bytes.seek(0)
-                
-                size = len(image_data)
-                if size == 0:
-                    logger.warning("Изображение пустое, создаем заглушку")
-                    return self._create_placeholder_image(prompt)
-                
-                logger.info(f"Изображение успешно сгенерировано (размер: {size} байт)")
-                return image_bytes
-                
-            except Exception as e:
-                logger.warning(f"Попытка {attempt + 1} не удалась при генерации изображения: {e}")
-                if attempt == 2:
-                    logger.error(f"Ошибка при генерации изображения после 3 попыток: {e}")
-                    logger.info("Создаем изображение-заглушку")
-                    return self._create_placeholder_image(prompt)
-                time.sleep(2 ** attempt)  # exponential backoff
+        logger.info("Генерация изображения по промпту: %.100s...", prompt)
+        
+        try:
+            response = await self._generate_image_content(prompt)
+            
+            # Извлекаем изображение
+            image_data = _extract_inline_data(response)
+            
+            # Если изображение не получено, создаем заглушку
+            if not image_data:
+                logger.warning("Не удалось извлечь изображение из ответа API, создаем заглушку")
+                return self._create_placeholder_image(prompt)
+            
+            # BytesIO использует переданный bytes без копирования до первой записи
+            image_bytes = BytesIO(image_data)
+            
+            logger.info("Изображение успешно сгенерировано (размер: %d байт)", len(image_data))
+            return image_bytes
+            
+        except Exception as e:
+            logger.error("Ошибка при генерации изображения: %s", e)
+            logger.info("Создаем изображение-заглушку")
+            return self._create_placeholder_image(prompt)
+    
+    @_retry_transient
+    async def _generate_text(self, prompt: str) -> str:
+        """
+        Запрос к текстовой модели с повторами при временных ошибках
+        
+        Args:
+            prompt: Промпт для модели
+            
+        Returns:
+            Текст ответа модели без пробелов по краям
+        """
+        try:
+            response = await self.text_model.generate_content_async(prompt)
+        except _TRANSIENT_API_ERRORS as e:
+            raise TransientGeminiError(str(e)) from e
+        
+        # response.text собирает текст из частей ответа, поэтому читаем его один раз
+        text = response.text if response else None
+        if not text:
+            raise TransientGeminiError("Пустой ответ от модели")
+        
+        return text.strip()
+    
+    @_retry_transient
+    async def _generate_image_content(self, prompt: str):
+        """
+        Запрос к модели изображений с повторами при временных ошибках
+        
+        Args:
+            prompt: Промпт для генерации
+            
+        Returns:
+            Ответ модели
+        """
+        try:
+            response = await self.image_model.generate_content_async(prompt)
+        except _TRANSIENT_API_ERRORS as e:
+            raise TransientGeminiError(str(e)) from e
+        
+        if not response:
+            raise TransientGeminiError("Пустой ответ от модели")
+        
+        return response
     
     async def edit_text_with_instruction(self, current_text: str, instruction: str) -> str:
         """
         Редактировать текст по инструкции
         
+        Не кэшируется: повтор той же инструкции должен давать новый вариант текста.
+        
         Args:
             current_text: Текущий текст поста
             instruction: Инструкция редактирования
@@ -201,26 +354,17 @@ class GeminiService:
         Returns:
             Отредактированный текст
         """
-        prompt = f"Изменить текст согласно инструкции: '{instruction}'. Текущий текст: '{current_text}'. Верни только измененный текст, без лишних объяснений."
+        prompt = "".join((_EDIT_PREFIX, instruction, _EDIT_MIDDLE, current_text, _EDIT_SUFFIX))
         
-        for attempt in range(3):
-            try:
-                response = await self.text_model.generate_content_async(prompt)
-                
-                if not response or not response.text:
-                    raise ValueError("Пустой ответ от модели")
-                
-                edited_text = response.text.strip()
-                logger.info(f"Текст отредактирован: '{current_text}' -> '{edited_text}' по инструкции '{instruction}'")
-                
-                return edited_text
-                
-            except Exception as e:
-                logger.warning(f"Попытка {attempt + 1} не удалась при редактировании текста: {e}")
-                if attempt == 2:
-                    logger.error(f"Ошибка при редактировании текста после 3 попыток: {e}")
-                    raise
-                await asyncio.sleep(2 ** attempt)  # exponential backoff
+        try:
+            edited_text = await self._generate_text(prompt)
+        except Exception as e:
+            logger.error("Ошибка при редактировании текста: %s", e)
+            raise
+        
+        logger.info("Текст отредактирован: '%s' -> '%s' по инструкции '%s'", current_text, edited_text, instruction)
+        
+        return edited_text
     
     def _create_placeholder_image(self, text: str) -> BytesIO:
         """
@@ -232,36 +376,19 @@ class GeminiService:
         Returns:
             BytesIO с изображением
         """
-        from PIL import Image, ImageDraw, ImageFont
-        
-        # Создаем красивое изображение
-        img = Image.new('RGB', (1200, 630), color='#1a1a2e')
-        draw = ImageDraw.Draw(img)
-        
-        # Заголовок
-        title = "🖼️ Новость"
-        try:
-            # Пытаемся использовать системный шрифт
-            font_title = ImageFont.truetype("arial.ttf", 60)
-            font_text = ImageFont.truetype("arial.ttf", 30)
-        except:
-            font_title = ImageFont.load_default()
-            font_text = ImageFont.load_default()
-        
-        # Рисуем заголовок
-        bbox = draw.textbbox((0, 0), title, font=font_title)
-        title_width = bbox[2] - bbox[0]
-        draw.text(((1200 - title_width) // 2, 200), title, fill='#ffffff', font=font_title)
-        
-        # Рисуем подзаголовок
-        subtitle = "Изображение генерируется..."
-        bbox = draw.textbbox((0, 0), subtitle, font=font_text)
-        subtitle_width = bbox[2] - bbox[0]
-        draw.text(((1200 - subtitle_width) // 2, 300), subtitle, fill='#888888', font=font_text)
-        
-        # Сохраняем в BytesIO
-        image_bytes = BytesIO()
-        img.save(image_bytes, format='PNG')
-        image_bytes.seek(0)
-        
-        return image_bytes
\ No newline at end of file
+        # Заглушка статична, поэтому отдаем заранее отрисованный PNG
+        return BytesIO(_PLACEHOLDER_PNG)
+
+
+@lru_cache(maxsize=None)
+def get_gemini_service() -> GeminiService:
+    """
+    Получить общий экземпляр сервиса Gemini
+    
+    SDK держит один канал к API на процесс после genai.configure(),
+    поэтому сервис создается один раз и переиспользуется всеми обработчиками.
+    
+    Returns:
+        Экземпляр GeminiService
+    """
+    return GeminiService()
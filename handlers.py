@@ -1,23 +1,53 @@
+import asyncio
 import logging
-from telegram import Update, InputMediaPhoto
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from io import BytesIO
+from telegram import Message, Update, InputMediaPhoto
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 
-from config import Config
+from config import CONFIG
 from gemini_service import GeminiService
 from storage import PostStorage, PostData
-from keyboards import Keyboards
+from keyboards import POST_ACTIONS, EDIT_OPTIONS, IMAGE_EDIT, TEXT_EDIT, CANCEL
 
 logger = logging.getLogger(__name__)
 
 
+class UserState(IntEnum):
+    """Состояние диалога с пользователем (какой ввод ожидается)"""
+    IDLE = 0
+    MANUAL_EDIT = 1
+    AI_EDIT = 2
+    IMAGE = 3
+
+
 class BotHandlers:
     """Обработчики событий бота"""
     
     def __init__(self, gemini_service: GeminiService, storage: PostStorage):
         self.gemini = gemini_service
         self.storage = storage
-        self.keyboards = Keyboards()
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        # Сколько корутин держат или ждут блокировку чата
+        self._lock_users: dict[int, int] = {}
+        
+        # Маршруты callback'ов строятся один раз, а не на каждое нажатие
+        self._callback_routes = {
+            "send": self._handle_send,
+            "cancel": self._handle_cancel,
+            "edit": self._handle_edit,
+            "edit_image": self._handle_edit_image,
+            "edit_text": self._handle_edit_text,
+            "regenerate_image": self._handle_regenerate_image,
+            "upload_image": self._handle_upload_image,
+            "ai_edit_text": self._handle_ai_edit_text,
+            "manual_edit_text": self._handle_manual_edit_text,
+            "back_to_preview": self._handle_back_to_preview,
+            "back_to_edit": self._handle_back_to_edit,
+            "cancel_operation": self._handle_cancel_operation,
+        }
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """
@@ -30,19 +60,17 @@ class BotHandlers:
         if not update.message:
             return
         
-        # Логируем тип сообщения для отладки
-        logger.info(f"Получено сообщение: text={bool(update.message.text)}, photo={bool(update.message.photo)}, video={bool(update.message.video)}, caption={bool(update.message.caption)}, forwarded={bool(update.message.forward_date)}")
-        
-        # Проверяем флаги ожидания
-        if context.user_data.get('waiting_for_manual_edit'):
-            await self._handle_manual_edit_input(update, context)
-            return
-        elif context.user_data.get('waiting_for_ai_edit'):
-            await self._handle_ai_edit_input(update, context)
-            return
-        elif context.user_data.get('waiting_for_image'):
-            await self._handle_image_upload(update, context)
-            return
+        # Проверяем, ждем ли мы ввод для редактирования
+        match context.user_data.get('state', UserState.IDLE):
+            case UserState.MANUAL_EDIT:
+                await self._handle_manual_edit_input(update, context)
+                return
+            case UserState.AI_EDIT:
+                await self._handle_ai_edit_input(update, context)
+                return
+            case UserState.IMAGE:
+                await self._handle_image_upload(update, context)
+                return
         
         # Проверяем, есть ли текст или фото с подписью или видео с подписью
         has_text = bool(update.message.text)
@@ -53,6 +81,17 @@ class BotHandlers:
             logger.info("Сообщение не подходит под условия обработки")
             return
         
+        # Логируем тип сообщения для отладки
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Получено сообщение: text=%s, photo=%s, video=%s, caption=%s, forwarded=%s",
+                bool(update.message.text),
+                bool(update.message.photo),
+                bool(update.message.video),
+                bool(update.message.caption),
+                bool(update.message.forward_date)
+            )
+        
         chat_id = update.message.chat_id
         
         # Получаем текст новости
@@ -61,74 +100,72 @@ class BotHandlers:
         else:
             news_text = update.message.caption
         
-        logger.info(f"Получена новость от пользователя {chat_id}")
-        
-        # Отправляем сообщение о начале обработки
-        processing_msg = await update.message.reply_text(
-            "⏳ Обрабатываю новость..."
-        )
+        logger.info("Получена новость от пользователя %s", chat_id)
         
-        try:
-            # Проверяем, есть ли фото в сообщении (только если одно фото и нет видео)
-            user_image = None
-            if update.message.photo and len(update.message.photo) == 1 and not update.message.video:
-                # Скачиваем фото пользователя
-                photo = update.message.photo[-1]  # Берем самое большое фото
-                user_image_file = await photo.get_file()
-                user_image = await user_image_file.download_as_bytearray()
-                
-                # Преобразуем в BytesIO
-                from io import BytesIO
-                user_image = BytesIO(user_image)
-                user_image.seek(0)
-            
-            # Обрабатываем новость через Gemini
-            shortened_text, image = await self.gemini.process_news_full(news_text, processing_msg, user_image)
-            
-            # Проверяем, что изображение не пустое
-            image.seek(0)
-            image_data = image.read()
-            if len(image_data) == 0:
-                raise ValueError("Сгенерированное изображение пустое")
-            
-            # Возвращаемся к началу BytesIO
-            image.seek(0)
-            
-            # Сохраняем данные поста
-            post_data = PostData(
-                text=shortened_text,
-                image=image,
-                chat_id=chat_id,
-                original_text=news_text
+        # Одновременно в чате выполняется только одна тяжелая операция с Gemini
+        async with self._lock(chat_id):
+            # Отправляем сообщение о начале обработки
+            processing_msg = await update.message.reply_text(
+                "⏳ Обрабатываю новость..."
             )
-            self.storage.save(chat_id, post_data)
-            
-            # Удаляем сообщение о обработке
-            try:
-                await processing_msg.delete()
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение об обработке: {e}")
-            
-            # Отправляем превью поста с кнопками
-            await self._send_post_preview(update, shortened_text, image)
-            
-        except Exception as e:
-            logger.error(f"Ошибка при обработке новости: {e}", exc_info=True)
             
-            # Пробуем отредактировать сообщение об ошибке
             try:
-                await processing_msg.edit_text(
-                    f"❌ Ошибка при обработке новости:\n{str(e)}\n\n"
-                    f"Попробуйте отправить новость еще раз."
-                )
-            except Exception:
-                # Если не получилось отредактировать, отправляем новое сообщение
-                await update.message.reply_text(
-                    f"❌ Ошибка при обработке новости:\n{str(e)}\n\n"
-                    f"Попробуйте отправить новость еще раз."
+                # Проверяем, есть ли фото в сообщении (только если одно фото и нет видео)
+                user_image = None
+                if update.message.photo and len(update.message.photo) == 1 and not update.message.video:
+                    # Скачиваем фото пользователя
+                    photo = update.message.photo[-1]  # Берем самое большое фото
+                    user_image_file = await photo.get_file()
+                    
+                    # Скачиваем сразу в BytesIO, без промежуточного bytearray
+                    user_image = BytesIO()
+                    await user_image_file.download_to_memory(user_image)
+                
+                # Обрабатываем новость через Gemini
+                shortened_text, image = await self.gemini.process_news_full(news_text, processing_msg, user_image)
+                
+                # Проверяем, что изображение не пустое (getvalue не копирует буфер)
+                image_data = image.getvalue()
+                if not image_data:
+                    raise ValueError("Сгенерированное изображение пустое")
+                
+                # Сохраняем данные поста
+                post_data = PostData(
+                    text=shortened_text,
+                    image=image_data,
+                    chat_id=chat_id,
+                    original_text=news_text
                 )
+                self.storage.save(chat_id, post_data)
+                image_version = post_data.image_version
+                
+                # Удаляем сообщение о обработке
+                try:
+                    await processing_msg.delete()
+                except Exception as e:
+                    logger.warning("Не удалось удалить сообщение об обработке: %s", e)
+                
+                # Отправляем превью поста с кнопками
+                preview = await self._send_post_preview(update, shortened_text, image_data)
+                self._remember_file_id(chat_id, preview, image_version)
+                
+            except Exception as e:
+                logger.error("Ошибка при обработке новости: %s", e, exc_info=True)
+                
+                # Пробуем отредактировать сообщение об ошибке
+                try:
+                    await processing_msg.edit_text(
+                        f"❌ Ошибка при обработке новости:\n{str(e)}\n\n"
+                        f"Попробуйте отправить новость еще раз."
+                    )
+                except Exception:
+                    # Если не получилось отредактировать, отправляем новое сообщение
+                    await update.message.reply_text(
+                        f"❌ Ошибка при обработке новости:\n{str(e)}\n\n"
+                        f"Попробуйте отправить новость еще раз."
+                    )
     
-    async def _send_post_preview(self, update: Update, text: str, image) -> None:
+    async def _send_post_preview(self, update: Update, text: str, image) -> Message:
         """
         Отправить превью поста с кнопками
         
@@ -136,16 +173,67 @@ class BotHandlers:
             update: Объект обновления Telegram
             text: Текст поста
             image: Изображение поста
+            
+        Returns:
+            Отправленное сообщение с превью
         """
-        # Сбрасываем позицию в начало BytesIO
-        image.seek(0)
-        
-        await update.message.reply_photo(
+        return await update.message.reply_photo(
             photo=image,
             caption=text,
-            reply_markup=self.keyboards.get_post_actions_keyboard()
+            reply_markup=POST_ACTIONS
         )
     
+    @asynccontextmanager
+    async def _lock(self, chat_id: int):
+        """
+        Захватить блокировку чата для тяжелых операций с Gemini
+        
+        Блокировка удаляется, только когда ее никто не держит и не ждет,
+        поэтому две операции одного чата не могут получить разные блокировки.
+        
+        Args:
+            chat_id: ID чата
+        """
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._lock_users[chat_id] = self._lock_users.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            users = self._lock_users.pop(chat_id) - 1
+            if users:
+                self._lock_users[chat_id] = users
+            else:
+                del self._chat_locks[chat_id]
+    
+    @staticmethod
+    def _get_photo(post_data: PostData):
+        """
+        Получить фото поста для отправки
+        
+        Args:
+            post_data: Данные поста
+            
+        Returns:
+            file_id, если изображение уже загружено в Telegram, иначе байты изображения
+        """
+        if post_data.file_id:
+            return post_data.file_id
+        
+        return post_data.get_image()
+    
+    def _remember_file_id(self, chat_id: int, message, image_version: int) -> None:
+        """
+        Запомнить file_id фото из отправленного сообщения, чтобы не загружать его повторно
+        
+        Args:
+            chat_id: ID чата
+            message: Отправленное или отредактированное сообщение
+            image_version: Версия изображения поста на момент отправки
+        """
+        if isinstance(message, Message) and message.photo:
+            self.storage.update_file_id(chat_id, message.photo[-1].file_id, image_version)
+    
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """
         Обработка нажатий на инлайн-кнопки
@@ -160,29 +248,14 @@ class BotHandlers:
         callback_data = query.data
         chat_id = query.message.chat_id
         
-        logger.info(f"Получен callback: {callback_data} от пользователя {chat_id}")
+        logger.info("Получен callback: %s от пользователя %s", callback_data, chat_id)
         
         # Маршрутизация по типу callback
-        handlers_map = {
-            "send": self._handle_send,
-            "cancel": self._handle_cancel,
-            "edit": self._handle_edit,
-            "edit_image": self._handle_edit_image,
-            "edit_text": self._handle_edit_text,
-            "regenerate_image": self._handle_regenerate_image,
-            "upload_image": self._handle_upload_image,
-            "ai_edit_text": self._handle_ai_edit_text,
-            "manual_edit_text": self._handle_manual_edit_text,
-            "back_to_preview": self._handle_back_to_preview,
-            "back_to_edit": self._handle_back_to_edit,
-            "cancel_operation": self._handle_cancel_operation,
-        }
-        
-        handler = handlers_map.get(callback_data)
+        handler = self._callback_routes.get(callback_data)
         if handler:
             await handler(update, context)
         else:
-            logger.warning(f"Неизвестный callback: {callback_data}")
+            logger.warning("Неизвестный callback: %s", callback_data)
     
     async def _handle_send(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Отправить пост в целевую группу"""
@@ -196,10 +269,9 @@ class BotHandlers:
         
         try:
             # Отправляем в целевую группу
-            post_data.image.seek(0)
             await context.bot.send_photo(
-                chat_id=Config.TARGET_GROUP_ID,
-                photo=post_data.image,
+                chat_id=CONFIG.target_group_id,
+                photo=self._get_photo(post_data),
                 caption=post_data.text
             )
             
@@ -212,7 +284,7 @@ class BotHandlers:
             self.storage.delete(chat_id)
             
         except Exception as e:
-            logger.error(f"Ошибка при отправке поста: {e}")
+            logger.error("Ошибка при отправке поста: %s", e)
             await query.edit_message_caption(
                 caption=f"❌ Ошибка при отправке: {str(e)}"
             )
@@ -229,21 +301,21 @@ class BotHandlers:
         """Показать опции редактирования"""
         query = update.callback_query
         await query.edit_message_reply_markup(
-            reply_markup=self.keyboards.get_edit_options_keyboard()
+            reply_markup=EDIT_OPTIONS
         )
     
     async def _handle_edit_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Показать опции редактирования изображения"""
         query = update.callback_query
         await query.edit_message_reply_markup(
-            reply_markup=self.keyboards.get_image_edit_keyboard()
+            reply_markup=IMAGE_EDIT
         )
     
     async def _handle_edit_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Показать опции редактирования текста"""
         query = update.callback_query
         await query.edit_message_reply_markup(
-            reply_markup=self.keyboards.get_text_edit_keyboard()
+            reply_markup=TEXT_EDIT
         )
     
     async def _handle_regenerate_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -251,76 +323,70 @@ class BotHandlers:
         query = update.callback_query
         chat_id = query.message.chat_id
         
-        post_data = self.storage.get(chat_id)
-        if not post_data:
-            await query.answer("❌ Данные не найдены", show_alert=True)
-            return
-        
         await query.answer("⏳ Генерирую новое изображение...")
         
-        try:
-            # Отправляем сообщение о начале обработки
-            processing_msg = await query.message.reply_text("⏳ Генерирую новое изображение...")
-            
-            # Генерируем новый промпт и изображение
-            image_prompt = await self.gemini.generate_image_prompt(post_data.text)
-            
-            # Используем executor для синхронного вызова
-            import asyncio
-            loop = asyncio.get_event_loop()
-            new_image = await loop.run_in_executor(
-                None,
-                lambda: self.gemini._generate_image_sync(image_prompt)
-            )
-            
-            # Проверяем изображение
-            new_image.seek(0)
-            image_data = new_image.read()
-            if len(image_data) == 0:
-                raise ValueError("Сгенерированное изображение пустое")
-            
-            new_image.seek(0)
-            
-            # Обновляем изображение
-            self.storage.update_image(chat_id, new_image)
-            
-            # Обновляем превью в том же сообщении
-            new_image.seek(0)
-            media = InputMediaPhoto(media=new_image, caption=post_data.text)
-            await query.edit_message_media(
-                media=media,
-                reply_markup=self.keyboards.get_post_actions_keyboard()
-            )
+        # Одновременно в чате выполняется только одна тяжелая операция с Gemini
+        async with self._lock(chat_id):
+            # Пост читается под блокировкой: пока ее ждали, мог быть сохранен новый пост
+            post_data = self.storage.get(chat_id)
+            if not post_data:
+                await query.message.reply_text("❌ Данные поста не найдены")
+                return
             
-            # Удаляем сообщение об обработке
             try:
-                await processing_msg.delete()
+                # Отправляем сообщение о начале обработки
+                processing_msg = await query.message.reply_text("⏳ Генерирую новое изображение...")
+                
+                # Генерируем новый промпт и изображение
+                image_prompt = await self.gemini.generate_image_prompt(post_data.text)
+                
+                new_image = await self.gemini._generate_image_async(image_prompt)
+                
+                # Проверяем изображение (getvalue не копирует буфер)
+                if not new_image.getvalue():
+                    raise ValueError("Сгенерированное изображение пустое")
+                
+                # Обновляем изображение
+                self.storage.update_image(chat_id, new_image)
+                image_version = post_data.image_version
+                
+                # Обновляем превью в том же сообщении
+                media = InputMediaPhoto(media=post_data.get_image(), caption=post_data.text)
+                preview = await query.edit_message_media(
+                    media=media,
+                    reply_markup=POST_ACTIONS
+                )
+                self._remember_file_id(chat_id, preview, image_version)
+                
+                # Удаляем сообщение об обработке
+                try:
+                    await processing_msg.delete()
+                except Exception as e:
+                    logger.warning("Не удалось удалить сообщение об обработке: %s", e)
+                
             except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение об обработке: {e}")
-            
-        except Exception as e:
-            logger.error(f"Ошибка при перегенерации изображения: {e}", exc_info=True)
-            # Пробуем отредактировать сообщение об ошибке
-            try:
-                await processing_msg.edit_text(f"❌ Ошибка при генерации изображения: {str(e)}")
-            except Exception:
-                # Если не получилось отредактировать, отправляем новое сообщение
-                await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+                logger.error("Ошибка при перегенерации изображения: %s", e, exc_info=True)
+                # Пробуем отредактировать сообщение об ошибке
+                try:
+                    await processing_msg.edit_text(f"❌ Ошибка при генерации изображения: {str(e)}")
+                except Exception:
+                    # Если не получилось отредактировать, отправляем новое сообщение
+                    await query.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
     
     async def _handle_upload_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Запросить загрузку своего изображения"""
         query = update.callback_query
-        context.user_data['waiting_for_image'] = True
+        context.user_data['state'] = UserState.IMAGE
         await query.answer()
         await query.message.reply_text(
             "📤 Отправьте изображение, которое хотите использовать",
-            reply_markup=self.keyboards.get_cancel_keyboard()
+            reply_markup=CANCEL
         )
     
     async def _handle_image_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка загруженного изображения"""
-        # Очищаем флаг
-        context.user_data.pop('waiting_for_image', None)
+        # Сбрасываем состояние ожидания
+        context.user_data.pop('state', None)
         
         # Проверяем, что отправлено фото
         if not update.message.photo:
@@ -331,12 +397,10 @@ class BotHandlers:
             # Скачиваем фото
             photo = update.message.photo[-1]  # Берем самое большое фото
             user_image_file = await photo.get_file()
-            user_image_data = await user_image_file.download_as_bytearray()
             
-            # Преобразуем в BytesIO
-            from io import BytesIO
-            user_image = BytesIO(user_image_data)
-            user_image.seek(0)
+            # Скачиваем сразу в BytesIO, без промежуточного bytearray
+            user_image = BytesIO()
+            await user_image_file.download_to_memory(user_image)
             
             # Получаем данные поста
             chat_id = update.message.chat_id
@@ -347,20 +411,21 @@ class BotHandlers:
             
             # Обновляем изображение
             self.storage.update_image(chat_id, user_image)
+            image_version = post_data.image_version
             
             # Удаляем сообщение с изображением
             await update.message.delete()
             
             # Отправляем новое превью
-            user_image.seek(0)
-            await context.bot.send_photo(
+            preview = await context.bot.send_photo(
                 chat_id=chat_id,
-                photo=user_image,
+                photo=post_data.get_image(),
                 caption=post_data.text,
-                reply_markup=self.keyboards.get_post_actions_keyboard()
+                reply_markup=POST_ACTIONS
             )
+            self._remember_file_id(chat_id, preview, image_version)
         except Exception as e:
-            logger.error(f"Ошибка при обработке загруженного изображения: {e}")
+            logger.error("Ошибка при обработке загруженного изображения: %s", e)
             await update.message.reply_text(f"❌ Ошибка при обработке изображения: {str(e)}")
     
     async def reset_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -371,14 +436,10 @@ class BotHandlers:
             update: Объект обновления Telegram
             context: Контекст бота
         """
-        import os
-        
-        # Очистить файл хранилища
-        if os.path.exists(self.storage.storage_file):
-            os.remove(self.storage.storage_file)
-        
-        # Переинициализировать хранилище
-        self.storage = PostStorage()
+        # Очистить данные в памяти здесь же, в event loop, а файлы хранилища
+        # удалить в отдельном потоке, чтобы не блокировать event loop
+        self.storage.clear_memory()
+        await asyncio.to_thread(self.storage.delete_files)
         
         # Очистить пользовательские данные
         context.user_data.clear()
@@ -388,12 +449,12 @@ class BotHandlers:
     async def _handle_ai_edit_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """AI редактирование текста"""
         query = update.callback_query
-        context.user_data['waiting_for_ai_edit'] = True
+        context.user_data['state'] = UserState.AI_EDIT
         await query.answer()
         await query.message.reply_text(
             "✏️ Напишите, как изменить текст\n"
             "Например: 'Сделай короче' или 'Добавь эмодзи'",
-            reply_markup=self.keyboards.get_cancel_keyboard()
+            reply_markup=CANCEL
         )
     
     async def _handle_ai_edit_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -401,57 +462,65 @@ class BotHandlers:
         chat_id = update.message.chat_id
         instruction = update.message.text
         
-        # Очищаем флаг
-        context.user_data.pop('waiting_for_ai_edit', None)
-        
-        post_data = self.storage.get(chat_id)
-        if not post_data:
-            await update.message.reply_text("❌ Данные поста не найдены")
-            return
+        # Сбрасываем состояние ожидания
+        context.user_data.pop('state', None)
         
-        try:
-            # Отправляем сообщение о начале обработки
-            processing_msg = await update.message.reply_text("⏳ Редактирую текст с помощью AI...")
-            
-            # Редактируем текст через Gemini
-            edited_text = await self.gemini.edit_text_with_instruction(post_data.original_text or post_data.text, instruction)
-            
-            # Обновляем текст
-            self.storage.update_text(chat_id, edited_text)
+        # Одновременно в чате выполняется только одна тяжелая операция с Gemini
+        async with self._lock(chat_id):
+            # Пост читается под блокировкой: пока ее ждали, мог быть сохранен новый пост
+            post_data = self.storage.get(chat_id)
+            if not post_data:
+                await update.message.reply_text("❌ Данные поста не найдены")
+                return
             
-            # Удаляем сообщения
-            await update.message.delete()
             try:
-                await processing_msg.delete()
+                # Отправляем сообщение о начале обработки
+                processing_msg = await update.message.reply_text("⏳ Редактирую текст с помощью AI...")
+                
+                # Редактируем текст через Gemini
+                edited_text = await self.gemini.edit_text_with_instruction(post_data.original_text or post_data.text, instruction)
+                
+                # Обновляем текст
+                self.storage.update_text(chat_id, edited_text)
+                image_version = post_data.image_version
+                
+                # Удаляем сообщения и отправляем новое превью параллельно
+                user_msg_result, processing_msg_result, preview = await asyncio.gather(
+                    update.message.delete(),
+                    processing_msg.delete(),
+                    context.bot.send_photo(
+                        chat_id=chat_id,
+                        photo=self._get_photo(post_data),
+                        caption=edited_text,
+                        reply_markup=POST_ACTIONS
+                    ),
+                    return_exceptions=True
+                )
+                if isinstance(user_msg_result, Exception):
+                    logger.warning("Не удалось удалить сообщение с инструкцией: %s", user_msg_result)
+                if isinstance(processing_msg_result, Exception):
+                    logger.warning("Не удалось удалить сообщение об обработке: %s", processing_msg_result)
+                if isinstance(preview, Exception):
+                    raise preview
+                self._remember_file_id(chat_id, preview, image_version)
+                
             except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение об обработке: {e}")
-            
-            # Отправляем новое превью
-            post_data.image.seek(0)
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=post_data.image,
-                caption=edited_text,
-                reply_markup=self.keyboards.get_post_actions_keyboard()
-            )
-            
-        except Exception as e:
-            logger.error(f"Ошибка при AI редактировании текста: {e}")
-            # Пробуем отредактировать сообщение об ошибке
-            try:
-                await processing_msg.edit_text(f"❌ Ошибка при редактировании: {str(e)}")
-            except Exception:
-                # Если не получилось отредактировать, отправляем новое сообщение
-                await update.message.reply_text(f"❌ Ошибка при редактировании: {str(e)}")
+                logger.error("Ошибка при AI редактировании текста: %s", e)
+                # Пробуем отредактировать сообщение об ошибке
+                try:
+                    await processing_msg.edit_text(f"❌ Ошибка при редактировании: {str(e)}")
+                except Exception:
+                    # Если не получилось отредактировать, отправляем новое сообщение
+                    await update.message.reply_text(f"❌ Ошибка при редактировании: {str(e)}")
     
     async def _handle_manual_edit_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Ручное редактирование текста"""
         query = update.callback_query
-        context.user_data['waiting_for_manual_edit'] = True
+        context.user_data['state'] = UserState.MANUAL_EDIT
         await query.answer()
         await query.message.reply_text(
             "✏️ Отправьте новый текст для поста",
-            reply_markup=self.keyboards.get_cancel_keyboard()
+            reply_markup=CANCEL
         )
     
     async def _handle_manual_edit_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -459,8 +528,8 @@ class BotHandlers:
         chat_id = update.message.chat_id
         new_text = update.message.text
         
-        # Очищаем флаг
-        context.user_data.pop('waiting_for_manual_edit', None)
+        # Сбрасываем состояние ожидания
+        context.user_data.pop('state', None)
         
         post_data = self.storage.get(chat_id)
         if not post_data:
@@ -469,31 +538,32 @@ class BotHandlers:
         
         # Обновляем текст
         self.storage.update_text(chat_id, new_text)
+        image_version = post_data.image_version
         
         # Удаляем сообщение с новым текстом
         await update.message.delete()
         
         # Отправляем новое превью
-        post_data.image.seek(0)
-        await context.bot.send_photo(
+        preview = await context.bot.send_photo(
             chat_id=chat_id,
-            photo=post_data.image,
+            photo=self._get_photo(post_data),
             caption=new_text,
-            reply_markup=self.keyboards.get_post_actions_keyboard()
+            reply_markup=POST_ACTIONS
         )
+        self._remember_file_id(chat_id, preview, image_version)
     
     async def _handle_back_to_preview(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Вернуться к превью поста"""
         query = update.callback_query
         await query.edit_message_reply_markup(
-            reply_markup=self.keyboards.get_post_actions_keyboard()
+            reply_markup=POST_ACTIONS
         )
     
     async def _handle_back_to_edit(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Вернуться к меню редактирования"""
         query = update.callback_query
         await query.edit_message_reply_markup(
-            reply_markup=self.keyboards.get_edit_options_keyboard()
+            reply_markup=EDIT_OPTIONS
         )
     
     async def _handle_cancel_operation(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -506,39 +576,46 @@ class BotHandlers:
         
         chat_id = query.message.chat_id
         
-        logger.info(f"Отмена операции для чата {chat_id}")
+        logger.info("Отмена операции для чата %s", chat_id)
         
-        # Очищаем флаги ожидания
-        context.user_data.pop('waiting_for_manual_edit', None)
-        context.user_data.pop('waiting_for_ai_edit', None)
-        context.user_data.pop('waiting_for_image', None)
+        # Сбрасываем состояние ожидания
+        context.user_data.pop('state', None)
         
         # Получаем данные поста
         post_data = self.storage.get(chat_id)
-        logger.info(f"Получены данные поста для чата {chat_id}: {'да' if post_data else 'нет'}")
+        logger.info("Получены данные поста для чата %s: %s", chat_id, 'да' if post_data else 'нет')
         
-        # Удаляем сообщение с запросом
-        try:
-            await query.message.edit_text("✅ Операция отменена")
-            logger.info(f"Отредактировано сообщение запроса для чата {chat_id}")
-        except Exception as e:
-            logger.warning(f"Не удалось отредактировать сообщение: {e}")
-            # Если не получилось отредактировать, пробуем удалить
+        async def dismiss_prompt() -> None:
+            # Убираем сообщение с запросом
             try:
-                await query.message.delete()
-                logger.info(f"Удалено сообщение запроса для чата {chat_id}")
-            except Exception as e2:
-                logger.warning(f"Не удалось удалить сообщение: {e2}")
+                await query.message.edit_text("✅ Операция отменена")
+                logger.info("Отредактировано сообщение запроса для чата %s", chat_id)
+            except Exception as e:
+                logger.warning("Не удалось отредактировать сообщение: %s", e)
+                # Если не получилось отредактировать, пробуем удалить
+                try:
+                    await query.message.delete()
+                    logger.info("Удалено сообщение запроса для чата %s", chat_id)
+                except Exception as e2:
+                    logger.warning("Не удалось удалить сообщение: %s", e2)
         
         if post_data:
-            # Отправляем превью поста заново
-            post_data.image.seek(0)
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=post_data.image,
-                caption=post_data.text,
-                reply_markup=self.keyboards.get_post_actions_keyboard()
+            image_version = post_data.image_version
+            # Убираем запрос и отправляем превью поста заново параллельно
+            _, preview = await asyncio.gather(
+                dismiss_prompt(),
+                context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=self._get_photo(post_data),
+                    caption=post_data.text,
+                    reply_markup=POST_ACTIONS
+                ),
+                return_exceptions=True
             )
-            logger.info(f"Отправлено превью поста для чата {chat_id}")
+            if isinstance(preview, Exception):
+                raise preview
+            self._remember_file_id(chat_id, preview, image_version)
+            logger.info("Отправлено превью поста для чата %s", chat_id)
         else:
+            await dismiss_prompt()
             await query.answer("✅ Операция отменена")
\ No newline at end of file
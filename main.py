@@ -1,8 +1,14 @@
 import logging
 from telegram.ext import Application, MessageHandler, CallbackQueryHandler, CommandHandler, filters
 
-from config import Config
-from gemini_service import GeminiService
+try:
+    import uvloop
+except ImportError:
+    # uvloop недоступен (например, на Windows) - используем стандартный event loop
+    uvloop = None
+
+from config import CONFIG
+from gemini_service import get_gemini_service
 from storage import PostStorage
 from handlers import BotHandlers
 
@@ -19,7 +25,7 @@ def main() -> None:
     
     # Проверяем конфигурацию
     try:
-        Config.validate()
+        CONFIG.validate()
     except ValueError as e:
         logger.error(f"Ошибка конфигурации: {e}")
         return
@@ -27,12 +33,21 @@ def main() -> None:
     logger.info("Запуск бота...")
     
     # Инициализируем сервисы
-    gemini_service = GeminiService()
+    gemini_service = get_gemini_service()
     storage = PostStorage()
     handlers = BotHandlers(gemini_service, storage)
     
-    # Создаем приложение бота
-    application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+    # Создаем приложение бота.
+    # Обновления обрабатываются параллельно (корутинами в одном event loop), поэтому
+    # обработчики не должны разделять изменяемое состояние между await без блокировки
+    # по чату. Данные постов в PostStorage меняются только из event loop; запись
+    # на диск идет в потоке таймера и работает со снимком данных.
+    application = (
+        Application.builder()
+        .token(CONFIG.telegram_bot_token)
+        .concurrent_updates(256)
+        .build()
+    )
     
     # Регистрируем обработчики
     # Обработка текстовых сообщений и сообщений с фото/видео (новостей)
@@ -46,7 +61,11 @@ def main() -> None:
     # Обработка команд
     application.add_handler(CommandHandler("reset", handlers.reset_command))
     
-    # Запускаем бота
+    # Запускаем бота на uvloop, если он установлен
+    if uvloop is not None:
+        uvloop.install()
+        logger.info("Используется uvloop")
+    
     logger.info("Бот запущен и готов к работе")
     application.run_polling(allowed_updates=["message", "callback_query"])
 
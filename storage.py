@@ -1,96 +1,390 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from collections import OrderedDict
 from io import BytesIO
-from typing import Optional
+from typing import Iterable, Iterator, Optional, Union
+from contextlib import contextmanager
 import logging
 import json
 import os
-import base64
-import tempfile
+import binascii
+import hashlib
+import itertools
+import secrets
+import shutil
+import threading
+import atexit
+
+try:
+    import orjson
+except ImportError:
+    # orjson не установлен - используем стандартный json
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Задержка перед записью на диск: серия изменений подряд сливается в одну запись
+FLUSH_DELAY = 0.5
+
+# Сколько изображений постов держать в памяти одновременно
+MAX_CACHED_IMAGES = 32
+
+# Флаги создания временного файла: только новый файл; O_BINARY нужен на Windows
+_TMP_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+
+def _dumps(data: dict) -> bytes:
+    """
+    Сериализовать данные в JSON (UTF-8). Целочисленные ключи записываются строками
+    
+    Файл читает только бот, поэтому JSON пишется компактно;
+    с отступами - только при включенном DEBUG-логировании.
+    """
+    pretty = logger.isEnabledFor(logging.DEBUG)
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(raw: bytes) -> dict:
+    """Разобрать JSON"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _create_temp(dirname: str) -> tuple[int, str]:
+    """
+    Создать временный файл для атомарной записи
+    
+    В отличие от mkstemp (права 0600), файл создается с правами 0644,
+    к которым ОС сама применяет umask, - как обычный open().
+    
+    Args:
+        dirname: Каталог, в котором создается файл
+        
+    Returns:
+        Кортеж (дескриптор, путь к файлу)
+    """
+    while True:
+        tmp = os.path.join(dirname, f".storage.{secrets.token_hex(8)}")
+        try:
+            return os.open(tmp, _TMP_FLAGS, 0o644), tmp
+        except FileExistsError:
+            continue
+
 
-@dataclass
+def _write_atomic(path: str, data: bytes) -> None:
+    """
+    Записать файл атомарно: во временный файл рядом, затем подмена через os.replace
+    
+    При сбое посреди записи на диске остается прежняя версия файла.
+    
+    Args:
+        path: Путь к файлу
+        data: Содержимое файла
+    """
+    fd, tmp = _create_temp(os.path.dirname(os.path.abspath(path)))
+    try:
+        try:
+            # Пишем напрямую в дескриптор, без буферизованного файлового объекта.
+            # os.write может записать не все сразу, поэтому пишем остаток в цикле
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+@dataclass(slots=True)
 class PostData:
     """Данные поста для публикации"""
     text: str
-    image: BytesIO
+    image: Optional[bytes]
     chat_id: int
     original_text: Optional[str] = None
     message_id: Optional[int] = None
+    file_id: Optional[str] = None
+    # Файл изображения в хранилище; image равно None, пока изображение не прочитано из него
+    image_file: Optional[str] = field(default=None, repr=False, compare=False)
+    # Версия изображения: меняется при каждой замене, чтобы не принять file_id старого изображения
+    image_version: int = field(default=0, repr=False, compare=False)
+    
+    def get_image(self) -> bytes:
+        """
+        Получить изображение поста
+        
+        Returns:
+            Байты изображения. Выгруженное из памяти изображение читается из файла хранилища
+        """
+        image = self.image
+        if image is None:
+            with open(self.image_file, 'rb') as f:
+                image = self.image = f.read()
+        return image
 
 
 class PostStorage:
     """Хранилище данных постов для обработки"""
     
-    def __init__(self, storage_file: str = "post_storage.json"):
+    def __init__(self, storage_file: str = "post_storage.json", flush_delay: float = FLUSH_DELAY,
+                 max_images: int = MAX_CACHED_IMAGES):
         self.storage_file = storage_file
+        # Изображения хранятся отдельными файлами рядом с метаданными: post_storage.d/<хэш>.bin
+        self.image_dir = os.path.splitext(storage_file)[0] + '.d'
+        self.flush_delay = flush_delay
+        self.max_images = max_images
         self._posts: dict[int, PostData] = {}
+        # Чаты, изображения которых могут быть в памяти, - от давно не использованных к недавним
+        self._resident: OrderedDict[int, None] = OrderedDict()
+        # Чаты, изображения которых еще не записаны на диск
+        self._dirty: set[int] = set()
+        # Чаты, изображения которых записываются прямо сейчас
+        self._writing: set[int] = set()
+        # Метаданные постов изменились и еще не записаны на диск
+        self._meta_dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        self._flush_lock = threading.Lock()
+        # Глубина вложенности batch(): пока больше нуля, запись на диск не планируется
+        self._batch_depth = 0
+        # Источник версий изображений, уникальных в пределах процесса
+        self._image_versions = itertools.count(1)
         self._load_from_disk()
+        # Несохраненные изменения записываются при завершении процесса
+        atexit.register(self._flush_now)
         logger.info(f"Storage инициализирован, постов: {len(self._posts)}")
     
+    def _image_path(self, chat_id: int, image_path: Optional[str] = None) -> str:
+        """Путь к файлу изображения поста"""
+        return os.path.join(self.image_dir, image_path or f"{chat_id}.bin")
+    
     def _load_from_disk(self) -> None:
         """Загрузить данные с диска"""
-        if os.path.exists(self.storage_file):
-            logger.info(f"Найден файл storage: {self.storage_file}")
-            try:
-                with open(self.storage_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                logger.info(f"Загружен JSON с {len(data)} записями")
-                
-                for chat_id_str, post_dict in data.items():
-                    chat_id = int(chat_id_str)
-                    # Восстанавливаем BytesIO из base64
-                    image_data = base64.b64decode(post_dict['image_base64'])
-                    image = BytesIO(image_data)
-                    image.seek(0)
-                    
-                    post_data = PostData(
-                        text=post_dict['text'],
-                        image=image,
-                        chat_id=chat_id,
-                        original_text=post_dict.get('original_text'),
-                        message_id=post_dict.get('message_id')
-                    )
-                    self._posts[chat_id] = post_data
+        try:
+            with open(self.storage_file, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            logger.info(f"Файл storage не найден: {self.storage_file}")
+            return
+        except OSError as e:
+            logger.error(f"Ошибка чтения файла storage: {e}")
+            return
+        
+        logger.info(f"Найден файл storage: {self.storage_file}")
+        try:
+            data = _loads(raw)
+            
+            logger.info(f"Загружен JSON с {len(data)} записями")
+            
+            for chat_id_str, post_dict in data.items():
+                chat_id = int(chat_id_str)
+                image_file = self._image_path(chat_id, post_dict.get('image_path'))
+                if 'image_base64' in post_dict:
+                    # Старый формат: изображение в base64 внутри JSON,
+                    # переносится в отдельный файл сразу после загрузки
+                    image = binascii.a2b_base64(post_dict['image_base64'])
+                    image_file = None
+                    self._dirty.add(chat_id)
+                    self._meta_dirty = True
+                else:
+                    # Изображение читается из файла только при первом обращении
+                    image = None
                 
-                logger.info(f"Загружены данные для {len(self._posts)} постов")
+                post_data = PostData(
+                    text=post_dict['text'],
+                    image=image,
+                    chat_id=chat_id,
+                    original_text=post_dict.get('original_text'),
+                    message_id=post_dict.get('message_id'),
+                    file_id=post_dict.get('file_id'),
+                    image_file=image_file
+                )
+                self._posts[chat_id] = post_data
+                if image is not None:
+                    self._resident[chat_id] = None
+            
+            logger.info(f"Загружены данные для {len(self._posts)} постов")
+            
+            if self._meta_dirty:
+                # Однократная миграция старого формата
+                self._flush_now()
+                logger.info("Изображения из старого формата перенесены в отдельные файлы")
+        except Exception as e:
+            # Файл заменяется атомарно и не бывает записан наполовину,
+            # поэтому не удаляем его, а только сообщаем об ошибке
+            logger.error(f"Ошибка загрузки данных: {e}")
+    
+    def _schedule_flush(self, chat_id: Optional[int] = None) -> None:
+        """
+        Отметить данные измененными и запланировать отложенную запись на диск
+        
+        Args:
+            chat_id: ID чата, изображение которого изменилось (None - изменились только метаданные)
+        """
+        if chat_id is not None:
+            self._dirty.add(chat_id)
+        self._meta_dirty = True
+        if self._flush_timer is None and not self._batch_depth:
+            timer = threading.Timer(self.flush_delay, self._flush_now)
+            timer.daemon = True
+            self._flush_timer = timer
+            timer.start()
+    
+    def _flush_now(self) -> None:
+        """Записать накопленные изменения на диск"""
+        with self._flush_lock:
+            timer, self._flush_timer = self._flush_timer, None
+            if timer is not None and timer is not threading.current_thread():
+                timer.cancel()
+            
+            if not self._meta_dirty:
+                return
+            self._meta_dirty = False
+            # Копия множества: event loop может добавлять в него чаты во время записи
+            dirty = set(self._dirty)
+            # Пока изображения пишутся, их нельзя выгружать из памяти
+            self._writing = dirty
+            self._dirty.difference_update(dirty)
+            
+            try:
+                self._save_images(dirty)
+                self._save_to_disk()
+            finally:
+                self._writing = set()
+    
+    def _evict_images(self) -> None:
+        """
+        Выгрузить из памяти изображения давно не использованных постов сверх лимита
+        
+        Выгружаются только изображения, уже записанные в свой файл:
+        при следующем обращении они читаются из него заново.
+        """
+        excess = len(self._resident) - self.max_images
+        # Незаписанные изображения выгружать нельзя: если лишние - только они, обход не нужен
+        if excess - len(self._dirty) - len(self._writing) <= 0:
+            return
+        
+        # Обходим только чаты из _resident, начиная с давно не использованных
+        for _ in range(len(self._resident)):
+            if excess <= 0:
+                break
+            chat_id = next(iter(self._resident))
+            post = self._posts.get(chat_id)
+            if post is not None and post.image is not None:
+                if post.image_file is None or chat_id in self._dirty or chat_id in self._writing:
+                    # Изображение еще не записано - оставляем его в памяти
+                    self._resident.move_to_end(chat_id)
+                    continue
+                post.image = None
+            del self._resident[chat_id]
+            excess -= 1
+    
+    def _touch(self, chat_id: int) -> None:
+        """
+        Отметить изображение поста недавно использованным
+        
+        Args:
+            chat_id: ID чата
+        """
+        self._resident[chat_id] = None
+        self._resident.move_to_end(chat_id)
+        self._evict_images()
+    
+    def _retry_later(self, chat_ids: set[int]) -> None:
+        """
+        Вернуть незаписанные изменения в очередь: они будут записаны при следующей записи на диск
+        
+        Args:
+            chat_ids: ID чатов, изображения которых не удалось записать
+        """
+        self._dirty.update(chat_ids)
+        self._meta_dirty = True
+    
+    def _save_images(self, chat_ids: set[int]) -> None:
+        """
+        Записать на диск изображения измененных постов
+        
+        Файлы именуются по хэшу содержимого, поэтому одинаковые изображения
+        разных постов хранятся одним файлом, а неизмененное изображение не перезаписывается.
+        
+        Args:
+            chat_ids: ID чатов, изображения которых изменились
+        """
+        if not chat_ids:
+            return
+        try:
+            os.makedirs(self.image_dir, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Ошибка создания каталога изображений: {e}")
+            self._retry_later(chat_ids)
+            return
+        
+        failed = set()
+        for chat_id in chat_ids:
+            post_data = self._posts.get(chat_id)
+            if post_data is None or post_data.image is None:
+                continue
+            image = post_data.image
+            name = hashlib.blake2b(image, digest_size=16).hexdigest() + '.bin'
+            path = os.path.join(self.image_dir, name)
+            try:
+                if not os.path.exists(path):
+                    _write_atomic(path, image)
+                post_data.image_file = path
             except Exception as e:
-                logger.error(f"Ошибка загрузки данных: {e}")
-                # Удаляем поврежденный файл
-                try:
-                    os.remove(self.storage_file)
-                    logger.info("Поврежденный файл storage удален")
-                except:
-                    pass
-        else:
-            logger.info(f"Файл storage не найден: {self.storage_file}")
+                logger.error(f"Ошибка сохранения изображения для чата {chat_id}: {e}")
+                failed.add(chat_id)
+        
+        if failed:
+            # Незаписанное изображение - единственная копия, оно остается в памяти
+            self._retry_later(failed)
+        
+        # Удаляем файлы, на которые больше не ссылается ни один пост
+        referenced = {post.image_file for post in list(self._posts.values())}
+        try:
+            with os.scandir(self.image_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.bin') and entry.path not in referenced:
+                        os.remove(entry.path)
+        except OSError as e:
+            logger.error(f"Ошибка удаления неиспользуемых изображений: {e}")
     
     def _save_to_disk(self) -> None:
-        """Сохранить данные на диск"""
+        """Сохранить метаданные постов на диск"""
         try:
             data = {}
-            for chat_id, post_data in self._posts.items():
-                # Сохраняем изображение как base64
-                post_data.image.seek(0)
-                image_data = post_data.image.read()
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                
-                data[str(chat_id)] = {
+            # Снимок постов: запись идет из потока таймера, пока event loop меняет словарь
+            for chat_id, post_data in list(self._posts.items()):
+                if post_data.image_file is None:
+                    # Изображение еще не записано - пост попадет в следующую запись
+                    continue
+                data[chat_id] = {
                     'text': post_data.text,
                     'original_text': post_data.original_text,
-                    'image_base64': image_base64,
+                    'image_path': os.path.basename(post_data.image_file),
                     'chat_id': post_data.chat_id,
-                    'message_id': post_data.message_id
+                    'message_id': post_data.message_id,
+                    'file_id': post_data.file_id
                 }
             
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            _write_atomic(self.storage_file, _dumps(data))
             
-            logger.debug(f"Сохранены данные для {len(self._posts)} постов")
+            logger.debug(f"Сохранены данные для {len(data)} постов")
         except Exception as e:
             logger.error(f"Ошибка сохранения данных: {e}")
+            self._retry_later(set())
     
     def save(self, chat_id: int, post_data: PostData) -> None:
         """
@@ -100,8 +394,10 @@ class PostStorage:
             chat_id: ID чата
             post_data: Данные поста
         """
+        post_data.image_version = next(self._image_versions)
         self._posts[chat_id] = post_data
-        self._save_to_disk()
+        self._schedule_flush(chat_id)
+        self._touch(chat_id)
         logger.info(f"Сохранены данные поста для чата {chat_id}")
     
     def get(self, chat_id: int) -> Optional[PostData]:
@@ -114,7 +410,11 @@ class PostStorage:
         Returns:
             Данные поста или None
         """
-        return self._posts.get(chat_id)
+        post = self._posts.get(chat_id)
+        if post is not None:
+            # Полученный пост может прочитать изображение через get_image
+            self._touch(chat_id)
+        return post
     
     def delete(self, chat_id: int) -> None:
         """
@@ -125,9 +425,47 @@ class PostStorage:
         """
         if chat_id in self._posts:
             del self._posts[chat_id]
-            self._save_to_disk()
+            self._resident.pop(chat_id, None)
+            self._schedule_flush(chat_id)
             logger.info(f"Удалены данные поста для чата {chat_id}")
     
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Сгруппировать несколько изменений в одну запись на диск
+        
+        Пока блок выполняется, запись не планируется; она запускается один раз при выходе.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._meta_dirty:
+                self._schedule_flush()
+    
+    def save_many(self, items: Iterable[tuple[int, PostData]]) -> None:
+        """
+        Сохранить данные нескольких постов одной записью на диск
+        
+        Args:
+            items: Пары (ID чата, данные поста)
+        """
+        with self.batch():
+            for chat_id, post_data in items:
+                self.save(chat_id, post_data)
+    
+    def delete_many(self, chat_ids: Iterable[int]) -> None:
+        """
+        Удалить данные нескольких постов одной записью на диск
+        
+        Args:
+            chat_ids: ID чатов
+        """
+        with self.batch():
+            for chat_id in chat_ids:
+                self.delete(chat_id)
+    
     def update_text(self, chat_id: int, new_text: str) -> bool:
         """
         Обновить текст поста
@@ -142,33 +480,87 @@ class PostStorage:
         post = self.get(chat_id)
         if post:
             post.text = new_text
-            self._save_to_disk()
+            self._schedule_flush()
             logger.info(f"Обновлен текст поста для чата {chat_id}")
             return True
         return False
     
-    def update_image(self, chat_id: int, new_image: BytesIO) -> bool:
+    def update_image(self, chat_id: int, new_image: Union[bytes, BytesIO]) -> bool:
         """
         Обновить изображение поста
         
         Args:
             chat_id: ID чата
-            new_image: Новое изображение
+            new_image: Новое изображение (байты или BytesIO)
             
         Returns:
             True если обновлено, False если пост не найден
         """
         post = self.get(chat_id)
         if post:
-            post.image = new_image
-            self._save_to_disk()
+            # getvalue отдает содержимое BytesIO без копирования
+            post.image = new_image.getvalue() if isinstance(new_image, BytesIO) else new_image
+            # Загруженное ранее в Telegram изображение и файл в хранилище больше не актуальны
+            post.file_id = None
+            post.image_file = None
+            post.image_version = next(self._image_versions)
+            self._schedule_flush(chat_id)
             logger.info(f"Обновлено изображение поста для чата {chat_id}")
             return True
         return False
     
+    def update_file_id(self, chat_id: int, file_id: Optional[str], image_version: int) -> bool:
+        """
+        Запомнить file_id изображения, уже загруженного в Telegram
+        
+        Args:
+            chat_id: ID чата
+            file_id: file_id фото в Telegram
+            image_version: Версия изображения, которое было отправлено
+            
+        Returns:
+            True если обновлено, False если пост не найден, изображение
+            с тех пор заменено или file_id не изменился
+        """
+        post = self.get(chat_id)
+        if post and post.image_version == image_version and post.file_id != file_id:
+            post.file_id = file_id
+            self._schedule_flush()
+            logger.debug(f"Обновлен file_id изображения для чата {chat_id}")
+            return True
+        return False
+    
     def clear(self) -> None:
         """Очистить все данные"""
+        self.clear_memory()
+        self.delete_files()
+    
+    def clear_memory(self) -> None:
+        """
+        Очистить данные постов в памяти и отменить отложенную запись
+        
+        Вызывается из event loop: словари постов меняются только в нем.
+        """
+        timer, self._flush_timer = self._flush_timer, None
+        if timer is not None:
+            timer.cancel()
+        self._dirty.clear()
+        self._meta_dirty = False
         self._posts.clear()
-        if os.path.exists(self.storage_file):
-            os.remove(self.storage_file)
-        logger.info("Все данные постов очищены")
\ No newline at end of file
+        self._resident.clear()
+        logger.info("Все данные постов очищены")
+    
+    def delete_files(self) -> None:
+        """
+        Удалить файлы хранилища с диска
+        
+        Блокирующая операция, ее можно вызывать из отдельного потока.
+        Выполняющаяся запись на диск сначала завершается.
+        """
+        with self._flush_lock:
+            try:
+                os.remove(self.storage_file)
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(self.image_dir, ignore_errors=True)
+        logger.info("Файлы хранилища удалены")
\ No newline at end of file